@@ -11,9 +11,25 @@ import json
 import re
 from pathlib import Path
 from typing import List, Dict, Any
-from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import fitz  # PyMuPDF
 
+# --- Pre-compiled Patterns ---
+
+_NUMBERED_RE = re.compile(r'^(\d+(?:\.\d+)*)\s+.+')          # e.g., "2.1 Audience"
+_PAGE_FOOTER_RE = re.compile(r'^page\s+\d+\s+of\s+\d+', re.IGNORECASE)
+_DATE_NOISE_RE = re.compile(r'^\d{1,2} [A-Z]{3,}')           # e.g., "18 JUN"
+_WS_RE = re.compile(r'\s+')
+_H1_CONT_RE = re.compile(r'^\d\.\s')                        # e.g., "3. Overview..."
+_H1_PREFIX_RE = re.compile(r'^\d\.')
+
+# Multilingual section prefixes ("Chapter 1", "अध्याय 1", "第1章", ...) in one
+# anchored pattern; the shared "\s+\d+" tail is matched once, not per keyword
+_SECTION_PREFIX_RE = re.compile(r'^(?:(?:Chapter|Section|Capítulo|अध्याय|प्रकरण)\s+\d+|第\d+[章节])')
+
+# Keywords that are always promoted to H1
+_STRONG_H1S = frozenset({'Revision History', 'Table of Contents', 'Acknowledgements', 'References'})
+
 # --- Stage 1: Text Extraction & Document Profiling ---
 
 def extract_and_group_lines(pdf_path: str) -> (List[Dict[str, Any]], Dict):
@@ -21,57 +37,78 @@ def extract_and_group_lines(pdf_path: str) -> (List[Dict[str, Any]], Dict):
     Extracts text from the PDF and groups it into logical lines.
     Also builds a document profile.
     """
-    doc = fitz.open(pdf_path)
-    lines = {}
-    all_spans = []
-
-    for page_num, page in enumerate(doc):
-        blocks = page.get_text("dict", flags=fitz.TEXT_PRESERVE_LIGATURES)["blocks"]
-        for block in blocks:
-            if block['type'] == 0:  # Text block
-                for line in block.get("lines", []):
-                    line_bbox = line['bbox']
-                    # Use a key that groups text on the same vertical level
-                    line_key = (page_num, int(line_bbox[1]))
+    logical_lines = []
+    size_counts = {}
+    page_0_count = 0
+
+    # The context manager releases the MuPDF document even if extraction fails
+    with fitz.open(pdf_path) as doc:
+        # Lines are grouped and flushed one page at a time, so only the current
+        # page's spans are held in memory.
+        for page_num, page in enumerate(doc):
+            lines = {}
+            # "dict" is needed for per-span font data. Ligatures are expanded to
+            # plain characters (flags=0), which heading text does not need preserved.
+            blocks = page.get_text("dict", flags=0)["blocks"]
+            for block in blocks:
+                if block['type'] == 0:  # Text block
+                    for line in block.get("lines", []):
+                        line_bbox = line['bbox']
+                        # Use a key that groups text on the same vertical level
+                        line_key = int(line_bbox[1])
                     
-                    if line_key not in lines:
-                        lines[line_key] = {
-                            "spans": [],
-                            "bbox": line_bbox,
-                            "page": page_num
-                        }
+                        if line_key not in lines:
+                            lines[line_key] = {
+                                "spans": [],
+                                "bbox": line_bbox,
+                                "merged": False,
+                            }
+                        else:
+                            lines[line_key]['merged'] = True
                     
-                    for span in line['spans']:
-                        span['page'] = page_num # Ensure page number is attached to span
-                        all_spans.append(span)
-                        lines[line_key]['spans'].append(span)
-
-    # Reconstruct full lines from grouped spans
-    logical_lines = []
-    for key in sorted(lines.keys()):
-        line_data = lines[key]
-        line_spans = sorted(line_data['spans'], key=lambda s: s['bbox'][0])
-        
-        full_text = " ".join(s['text'] for s in line_spans).strip()
-        if full_text:
-            first_span = line_spans[0]
-            logical_lines.append({
-                "text": full_text,
-                "font_size": first_span["size"],
-                "font_name": first_span["font"],
-                "is_bold": "bold" in first_span["font"].lower() or (first_span['flags'] & 16) != 0,
-                "page": first_span["page"],
-                "bbox": line_data["bbox"],
-            })
+                        lines[line_key]['spans'].extend(line['spans'])
+
+            # Reconstruct full lines from grouped spans
+            for key in sorted(lines):
+                line_data = lines[key]
+                line_spans = line_data['spans']
+                # Spans of a single PyMuPDF line are already in reading order; only
+                # lines merged from several sources need re-ordering left to right.
+                if line_data['merged']:
+                    line_spans = sorted(line_spans, key=lambda s: s['bbox'][0])
+            
+                if len(line_spans) == 1:  # Most lines are a single span
+                    full_text = line_spans[0]['text'].strip()
+                else:
+                    full_text = " ".join([s['text'] for s in line_spans]).strip()
+                if full_text:
+                    first_span = line_spans[0]
+                    logical_lines.append({
+                        "text": full_text,
+                        "font_size": first_span["size"],
+                        "font_name": first_span["font"],
+                        "is_bold": "bold" in first_span["font"].lower() or (first_span['flags'] & 16) != 0,
+                        "page": page_num,
+                        "bbox": line_data["bbox"],
+                        "level": None,  # Set in place by find_headings
+                    })
+
+                    # Accumulate the document profile as lines are produced
+                    if len(full_text) > 20:
+                        size = first_span["size"]
+                        size_counts[size] = size_counts.get(size, 0) + 1
+
+            # Page 0 is flushed first, so every line so far belongs to it
+            if page_num == 0:
+                page_0_count = len(logical_lines)
 
     # Build Document Profile
     profile = {}
-    font_sizes = [s['font_size'] for s in logical_lines if len(s['text']) > 20]
-    profile['baseline_font_size'] = Counter(font_sizes).most_common(1)[0][0] if font_sizes else 12.0
+    # max() returns the first-seen value on ties, same as Counter.most_common
+    profile['baseline_font_size'] = max(size_counts, key=size_counts.get) if size_counts else 12.0
     
     # Page offset logic: if page 0 is a sparse cover, we adjust page numbers
-    page_0_lines = [line for line in logical_lines if line['page'] == 0]
-    profile['page_offset'] = 1 if len(page_0_lines) < 5 else 0
+    profile['page_offset'] = 1 if page_0_count < 5 else 0
 
     return logical_lines, profile
 
@@ -79,153 +116,97 @@ def extract_and_group_lines(pdf_path: str) -> (List[Dict[str, Any]], Dict):
 
 def extract_title(lines: List[Dict[str, Any]]) -> str:
     """Improved title extractor to merge top-aligned, large font lines on first page."""
-    page_0_lines = [line for line in lines if line['page'] == 0]
+    # Lines are produced in page order, so page 0 is a prefix of the list
+    page_0_lines = []
+    max_y = 0.0
+    for line in lines:
+        if line['page'] != 0:
+            break
+        page_0_lines.append(line)
+        if line['bbox'][3] > max_y:
+            max_y = line['bbox'][3]
+
     if not page_0_lines:
         return ""
 
     # Focus only on top 40% of the page
-    max_y = max(line['bbox'][3] for line in page_0_lines)
-    top_lines = [line for line in page_0_lines if line['bbox'][1] < 0.4 * max_y]
+    y_limit = 0.4 * max_y
+    top_lines = []
+    max_font = 0.0
+    for line in page_0_lines:
+        if line['bbox'][1] < y_limit:
+            top_lines.append(line)
+            if line['font_size'] > max_font:
+                max_font = line['font_size']
 
     if not top_lines:
         return ""
 
-    max_font = max(line['font_size'] for line in top_lines)
-    candidate_lines = [line for line in top_lines if abs(line['font_size'] - max_font) <= 0.5]
-
-    title = " ".join(line['text'].strip() for line in candidate_lines)
-    title = re.sub(r'\s+', ' ', title).strip()
+    title = " ".join([
+        line['text'].strip() for line in top_lines
+        if abs(line['font_size'] - max_font) <= 0.5
+    ])
+    title = _WS_RE.sub(' ', title).strip()
 
     return title
-    """Extracts a title by finding the largest text on the first page."""
-    page_0_lines = [line for line in lines if line['page'] == 0]
-    if not page_0_lines: return ""
-    
-    # Consider only the top half of the page for the title
-    page_height = max(line['bbox'][3] for line in page_0_lines)
-    top_half_lines = [line for line in page_0_lines if line['bbox'][1] < page_height / 2]
-    
-    if not top_half_lines: return ""
-        
-    max_font_size = max(line['font_size'] for line in top_half_lines)
-    title_lines = [line for line in top_half_lines if abs(line['font_size'] - max_font_size) < 0.5]
-    
-    title = " ".join(line['text'] for line in title_lines)
-    
-    # A simple filter to reject garbage titles
-    if "-----------" in title or len(re.findall(r'[a-zA-Z]', title)) < 5:
-        return ""
-        
-    return title
 
-def find_headings(lines: List[Dict[str, Any]], profile: Dict) -> List[Dict]:
-    """Improved heading extractor with stricter rules and better structure handling."""
-    headings = []
-    baseline_size = profile['baseline_font_size']
+def is_strong_heading(text: str, font_size: float, is_bold: bool, baseline_size: float):
+    """Classifies a stripped line of text as 'H1'-'H3', or False if it is not a heading."""
+    # --- Noise filter ---
+    if len(text) < 3:
+        return False
+    word_count = len(text.split())
+    if word_count > 20:
+        return False
 
-    def is_strong_heading(line):
-        text = line['text'].strip()
+    # Skip known junk
+    if _DATE_NOISE_RE.match(text):
+        return False
+    if _PAGE_FOOTER_RE.match(text):
+        return False
 
-        # --- Noise filter ---
-        if len(text) < 3 or len(text.split()) > 20:
-            return False
-
-        # Skip known junk
-        if re.match(r'^\d{1,2} [A-Z]{3,}', text):  # e.g., "18 JUN"
-            return False
-        if re.match(r'^page\s+\d+\s+of\s+\d+', text.lower()):
-            return False
-
-        # --- Structure-based detection (strong) ---
-        numbered_match = re.match(r'^(\d+(\.\d+)*)\s+.+', text)
-        if numbered_match:
-            level = numbered_match.group(1).count('.') + 1
-            if level <= 3:
-                return f'H{level}'
-
-        # --- Pattern-based multilingual match ---
-        common_section_prefixes = [
-            r'^Chapter\s+\d+', r'^Section\s+\d+', r'^Capítulo\s+\d+',
-            r'^अध्याय\s+\d+', r'^प्रकरण\s+\d+', r'^第\d+章', r'^第\d+节'
-        ]
-        for pat in common_section_prefixes:
-            if re.match(pat, text):
-                return 'H1'
-
-        # --- Format-based fallback (weaker) ---
-        is_large = line['font_size'] > baseline_size * 1.4
-        is_bold = line.get("is_bold", False)
-        is_short = len(text.split()) <= 10
-
-        if is_large and is_bold and is_short:
-            return 'H2'
+    # --- Structure-based detection (strong) ---
+    numbered_match = _NUMBERED_RE.match(text)
+    if numbered_match:
+        level = numbered_match.group(1).count('.') + 1
+        if level <= 3:
+            return f'H{level}'
 
-        return False
+    # --- Pattern-based multilingual match ---
+    if _SECTION_PREFIX_RE.match(text):
+        return 'H1'
 
-    # Special H1 override
-    strong_H1s = ['Revision History', 'Table of Contents', 'Acknowledgements', 'References']
-    for line in lines:
-        if line['text'].strip() in strong_H1s:
-            headings.append({**line, 'level': 'H1'})
+    # --- Format-based fallback (weaker) ---
+    is_large = font_size > baseline_size * 1.4
+    is_short = word_count <= 10
 
-    # Regular heading detection
-    for line in lines:
-        if line['text'].strip() in strong_H1s:
-            continue
+    if is_large and is_bold and is_short:
+        return 'H2'
 
-        level = is_strong_heading(line)
-        if level:
-            headings.append({**line, 'level': level})
+    return False
 
-    return headings
-    """Applies a precise, rule-based system to identify headings."""
+def find_headings(lines: List[Dict[str, Any]], profile: Dict) -> List[Dict]:
+    """
+    Improved heading extractor with stricter rules and better structure handling.
+    Matched lines are tagged with their 'level' in place and returned.
+    """
     headings = []
     baseline_size = profile['baseline_font_size']
-    
-    # --- Negative Filters ---
-    def is_noise(text):
-        # Filter out table data from Revision History
-        if re.match(r'^\d\.\d\s+\d{1,2}\s+[A-Z]{3,}', text):
-            return True
-        # Filter out page footers
-        if re.match(r'^page\s+\d+\s+of\s+\d+', text.lower()):
-            return True
-        return False
 
-    # --- Identify Special H1 Keywords First ---
-    special_h1s = ['Revision History', 'Table of Contents', 'Acknowledgements', 'References']
     for line in lines:
-        if line['text'] in special_h1s:
-            headings.append({**line, 'level': 'H1'})
+        text = line['text'].strip()
 
-    # --- Identify Structural and Formatted Headings ---
-    for line in lines:
-        text = line['text']
-        
-        if is_noise(text) or text in special_h1s:
+        # Special H1 override
+        if text in _STRONG_H1S:
+            line['level'] = 'H1'
+            headings.append(line)
             continue
 
-        # Structural Check (e.g., "1. Introduction", "2.1 Audience")
-        match = re.match(r'^(\d+(\.\d+)*)\s+(.+)', text)
-        if match:
-            # Must have a heading-like font size
-            if line['font_size'] >= baseline_size * 0.98:
-                level = match.group(1).count('.') + 1
-                if level <= 3:
-                    headings.append({**line, 'level': f'H{level}'})
-                    continue
-        
-        # Formatted Check (For non-numbered docs like the RFP)
-        if line['font_size'] > baseline_size * 1.2 and line['is_bold']:
-            if len(text.split()) < 15 and not text.endswith('.'):
-                 headings.append({**line, 'level': 'H2'})
-                 continue
-                 
-        # Visual Check (For flyers like STEM and TopJump)
-        if line['font_size'] > baseline_size * 1.8 and line['text'].isupper():
-            if len(text.split()) < 10:
-                headings.append({**line, 'level': 'H1'})
-                continue
+        # Regular heading detection
+        level = is_strong_heading(text, line['font_size'], line.get("is_bold", False), baseline_size)
+        if level:
+            line['level'] = level
+            headings.append(line)
 
     return headings
 
@@ -248,7 +229,7 @@ def finalize_outline(headings: List[Dict], profile: Dict) -> List[Dict]:
             nxt = headings[i+1]
             # Merge "3. Overview..." with "Syllabus"
             if (current['page'] == nxt['page'] and
-                re.match(r'^\d\.\s', current['text']) and not re.match(r'^\d\.', nxt['text'])):
+                _H1_CONT_RE.match(current['text']) and not _H1_PREFIX_RE.match(nxt['text'])):
                 current['text'] = f"{current['text'].replace(' - ', ' – ')}{nxt['text']}"
                 i += 1
         merged_headings.append(current)
@@ -259,7 +240,9 @@ def finalize_outline(headings: List[Dict], profile: Dict) -> List[Dict]:
     seen = set()
     page_offset = profile['page_offset']
     for item in merged_headings:
-        clean_text = re.sub(r'\s+', ' ', item['text']).strip()
+        # str.split() splits on the same characters as \s, so this equals
+        # _WS_RE.sub(' ', text).strip() without entering the regex engine
+        clean_text = ' '.join(item['text'].split())
         final_page = item['page'] + 1 - page_offset # Apply offset for correct page number
         
         # Use a combination of text and page as a unique key
@@ -310,14 +293,24 @@ def main():
         print(f"No PDF files found in '{INPUT_DIR}'. Please place PDFs there to process.")
         return
 
-    for pdf_file in pdf_files:
-        print(f"\nProcessing '{pdf_file.name}'...")
-        result = process_single_pdf(pdf_file)
-        
-        output_file = OUTPUT_DIR / f"{pdf_file.stem}.json"
-        with open(output_file, "w", encoding='utf-8') as f:
-            json.dump(result, f, indent=4, ensure_ascii=False)
-        print(f" -> Success. Outline saved to '{output_file.name}'")
+    # Each PDF is independent, so spread them across worker processes
+    max_workers = min(len(pdf_files), os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
+        for pdf_file in pdf_files:
+            print(f"\nProcessing '{pdf_file.name}'...")
+            futures[executor.submit(process_single_pdf, pdf_file)] = pdf_file
+
+        for future in as_completed(futures):
+            pdf_file = futures[future]
+            result = future.result()
+
+            output_file = OUTPUT_DIR / f"{pdf_file.stem}.json"
+            with open(output_file, "w", encoding='utf-8') as f:
+                # Serialize in one call and write once; json.dump with indent
+                # otherwise issues a separate write for every token
+                f.write(json.dumps(result, indent=4, ensure_ascii=False))
+            print(f" -> Success. Outline saved to '{output_file.name}'")
         
     print("\n--- All files processed. ---")
 
@@ -4,9 +4,23 @@ import json
 import re
 from pathlib import Path
 from typing import List, Dict, Any
-from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import fitz  # PyMuPDF
 
+# --- Pre-compiled Patterns ---
+
+# Expanded regex to support full-width ASCII, Devanagari (Hindi) numerals,
+# and common CJK separators (．, 、).
+_STRUCTURAL_PATTERNS = [
+    (re.compile(r'^([0-9０-９०-९]+)[.\．、]\s'), 'H1'),
+    (re.compile(r'^([0-9０-９०-९]+\.[0-9０-９०-९]+)\s'), 'H2'),
+    (re.compile(r'^([0-9０-９०-९]+\.[0-9０-９०-९]+\.[0-9０-９०-९]+)\s'), 'H3')
+]
+
+_REVISION_ROW_RE = re.compile(r'^\d\.\d+\s+\d{1,2}\s+[A-Z]{3,}')  # Revision History table rows
+_H1_CONT_RE = re.compile(r'^[0-9０-９०-९]+[.\．、]\s*')
+_H1_PREFIX_RE = re.compile(r'^[0-9０-９०-९]+[.\．、]')
+
 # --- Stage 1: Text Extraction & Document Profiling ---
 
 def extract_and_group_lines(pdf_path: str) -> (List[Dict[str, Any]], Dict):
@@ -14,50 +28,77 @@ def extract_and_group_lines(pdf_path: str) -> (List[Dict[str, Any]], Dict):
     Extracts text, groups it into lines, and builds a document profile.
     """
     doc = fitz.open(pdf_path)
-    lines = {}
-    
+    page_count = doc.page_count
+    logical_lines = []
+    size_counts = {}
+    margin_counts = {}
+    page_0_count = 0
+
+    # Lines are grouped and flushed one page at a time, so only the current
+    # page's spans are held in memory.
     for page_num, page in enumerate(doc):
-        blocks = page.get_text("dict", flags=fitz.TEXT_PRESERVE_LIGATURES)["blocks"]
+        lines = {}
+        # "dict" is needed for per-span font data. Ligatures are expanded to
+        # plain characters (flags=0), which heading text does not need preserved.
+        blocks = page.get_text("dict", flags=0)["blocks"]
         for block in blocks:
             if block['type'] == 0:  # Text block
                 for line in block.get("lines", []):
                     line_bbox = line['bbox']
-                    line_key = (page_num, int(line_bbox[1]))
+                    line_key = int(line_bbox[1])
                     
                     if line_key not in lines:
-                        lines[line_key] = {"spans": [], "bbox": line_bbox, "page": page_num}
+                        lines[line_key] = {"spans": [], "bbox": line_bbox, "merged": False}
+                    else:
+                        lines[line_key]['merged'] = True
                     
                     lines[line_key]['spans'].extend(line['spans'])
 
-    logical_lines = []
-    for key in sorted(lines.keys()):
-        line_data = lines[key]
-        line_spans = sorted(line_data['spans'], key=lambda s: s['bbox'][0])
-        
-        # Reconstruct line text by joining spans. This preserves spaces within spans
-        # and avoids inserting artificial spaces, which is better for CJK (Chinese, Japanese, Korean) languages.
-        full_text = "".join(s['text'] for s in line_spans).strip()
-        if full_text:
-            first_span = line_spans[0]
-            logical_lines.append({
-                "text": full_text,
-                "font_size": first_span["size"],
-                "font_name": first_span["font"],
-                "is_bold": "bold" in first_span["font"].lower() or (first_span['flags'] & 16) != 0,
-                "page": line_data["page"],
-                "bbox": line_data["bbox"],
-            })
+        for key in sorted(lines):
+            line_data = lines[key]
+            line_spans = line_data['spans']
+            # Spans of a single PyMuPDF line are already in reading order; only
+            # lines merged from several sources need re-ordering left to right.
+            if line_data['merged']:
+                line_spans = sorted(line_spans, key=lambda s: s['bbox'][0])
+            
+            # Reconstruct line text by joining spans. This preserves spaces within spans
+            # and avoids inserting artificial spaces, which is better for CJK (Chinese, Japanese, Korean) languages.
+            if len(line_spans) == 1:  # Most lines are a single span
+                full_text = line_spans[0]['text'].strip()
+            else:
+                full_text = "".join([s['text'] for s in line_spans]).strip()
+            if full_text:
+                first_span = line_spans[0]
+                logical_lines.append({
+                    "text": full_text,
+                    "font_size": first_span["size"],
+                    "font_name": first_span["font"],
+                    "is_bold": "bold" in first_span["font"].lower() or (first_span['flags'] & 16) != 0,
+                    "page": page_num,
+                    "bbox": line_data["bbox"],
+                    "level": None,  # Set in place by find_headings
+                })
+
+                # Accumulate the document profile as lines are produced
+                text_len = len(full_text)
+                if text_len > 15:
+                    size = first_span["size"]
+                    size_counts[size] = size_counts.get(size, 0) + 1
+                    if text_len > 20:
+                        margin = int(line_data["bbox"][0])
+                        margin_counts[margin] = margin_counts.get(margin, 0) + 1
+
+        # Page 0 is flushed first, so every line so far belongs to it
+        if page_num == 0:
+            page_0_count = len(logical_lines)
 
     # Build Document Profile
     profile = {}
-    font_sizes = [s['font_size'] for s in logical_lines if len(s['text']) > 15]
-    profile['baseline_font_size'] = Counter(font_sizes).most_common(1)[0][0] if font_sizes else 10.0
-    
-    page_0_lines = [line for line in logical_lines if line['page'] == 0]
-    profile['page_offset'] = 1 if len(page_0_lines) < 10 and doc.page_count > 1 else 0
-    
-    left_margins = [int(line['bbox'][0]) for line in logical_lines if len(line['text']) > 20]
-    profile['left_margin'] = Counter(left_margins).most_common(1)[0][0] if left_margins else 72
+    # max() returns the first-seen value on ties, same as Counter.most_common
+    profile['baseline_font_size'] = max(size_counts, key=size_counts.get) if size_counts else 10.0
+    profile['page_offset'] = 1 if page_0_count < 10 and page_count > 1 else 0
+    profile['left_margin'] = max(margin_counts, key=margin_counts.get) if margin_counts else 72
 
     doc.close()
     return logical_lines, profile
@@ -66,10 +107,17 @@ def extract_and_group_lines(pdf_path: str) -> (List[Dict[str, Any]], Dict):
 
 def extract_title(lines: List[Dict[str, Any]]) -> str:
     """Extracts a title by finding the largest text on the first page."""
-    page_0_lines = [line for line in lines if line['page'] == 0]
+    # Lines are produced in page order, so page 0 is a prefix of the list
+    page_0_lines = []
+    max_font_size = 0.0
+    for line in lines:
+        if line['page'] != 0:
+            break
+        page_0_lines.append(line)
+        if line['font_size'] > max_font_size:
+            max_font_size = line['font_size']
     if not page_0_lines: return ""
     
-    max_font_size = max(line['font_size'] for line in page_0_lines)
     title_lines = [line for line in page_0_lines if abs(line['font_size'] - max_font_size) < 0.5]
     title_lines.sort(key=lambda l: (l['bbox'][1], l['bbox'][0]))
     
@@ -78,19 +126,12 @@ def extract_title(lines: List[Dict[str, Any]]) -> str:
 def find_headings(lines: List[Dict[str, Any]], profile: Dict) -> List[Dict]:
     """
     Applies a precise, priority-based rule system to identify headings.
+    Matched lines are tagged with their 'level' in place and returned.
     """
     headings = []
     baseline_size = profile['baseline_font_size']
     left_margin = profile['left_margin']
     
-    # Expanded regex to support full-width ASCII, Devanagari (Hindi) numerals,
-    # and common CJK separators (．, 、).
-    structural_patterns = [
-        (re.compile(r'^([0-9０-９०-९]+)[.\．、]\s'), 'H1'),
-        (re.compile(r'^([0-9０-９०-९]+\.[0-9０-９०-९]+)\s'), 'H2'),
-        (re.compile(r'^([0-9０-９०-९]+\.[0-9０-９०-९]+\.[0-9０-９०-९]+)\s'), 'H3')
-    ]
-    
     # Added multilingual keywords for common section headers. Using a set for efficient lookup.
     special_h1s = {
         # English
@@ -110,15 +151,16 @@ def find_headings(lines: List[Dict[str, Any]], profile: Dict) -> List[Dict]:
         bbox = line['bbox']
         
         # --- Rule 0: Negative Filters ---
-        if '....' in text or re.match(r'^\d\.\d+\s+\d{1,2}\s+[A-Z]{3,}', text):
+        if '....' in text or _REVISION_ROW_RE.match(text):
             continue
 
         # --- Rule 1: Structural Patterns (with Positional Logic) ---
         matched_structure = False
-        for pattern, level in structural_patterns:
+        for pattern, level in _STRUCTURAL_PATTERNS:
             if pattern.match(text):
                 if abs(bbox[0] - left_margin) < 15: # Allow 15pt tolerance
-                    headings.append({**line, 'level': level})
+                    line['level'] = level
+                    headings.append(line)
                     matched_structure = True
                     break
         if matched_structure:
@@ -128,7 +170,8 @@ def find_headings(lines: List[Dict[str, Any]], profile: Dict) -> List[Dict]:
         # Used strip() to ensure accurate matching against the set.
         if text.strip() in special_h1s:
             if is_bold or font_size > baseline_size:
-                headings.append({**line, 'level': 'H1'})
+                line['level'] = 'H1'
+                headings.append(line)
                 continue
     
     return headings
@@ -147,11 +190,10 @@ def finalize_outline(headings: List[Dict], profile: Dict) -> List[Dict]:
         current = headings[i]
         if i + 1 < len(headings):
             nxt = headings[i+1]
-            h1_pattern = r'^[0-9０-９०-९]+[.\．、]\s*'
-            next_line_is_not_heading = not re.match(r'^[0-9０-９०-९]+[.\．、]', nxt['text'])
+            next_line_is_not_heading = not _H1_PREFIX_RE.match(nxt['text'])
 
             if (current['page'] == nxt['page'] and
-                re.match(h1_pattern, current['text']) and next_line_is_not_heading):
+                _H1_CONT_RE.match(current['text']) and next_line_is_not_heading):
                 # Merge text from the continuation line, ensuring a single space separator.
                 current['text'] = f"{current['text'].strip()} {nxt['text'].strip()}"
                 i += 1 # Skip the next line as it has been merged
@@ -162,8 +204,9 @@ def finalize_outline(headings: List[Dict], profile: Dict) -> List[Dict]:
     seen = set()
     page_offset = profile['page_offset']
     for item in merged_headings:
-        # Normalize whitespace for clean output
-        clean_text = re.sub(r'\s+', ' ', item['text']).strip()
+        # Normalize whitespace for clean output. str.split() splits on the same
+        # characters as \s, so this avoids a regex call per heading.
+        clean_text = ' '.join(item['text'].split())
         final_page = item['page'] + 1 - page_offset
         
         key = (clean_text.lower(), final_page)
@@ -213,14 +256,24 @@ def main():
         print(f"No PDF files found in '{INPUT_DIR}'. Please place PDFs there to process.")
         return
 
-    for pdf_file in pdf_files:
-        print(f"\nProcessing '{pdf_file.name}'...")
-        result = process_single_pdf(pdf_file)
-        
-        output_file = OUTPUT_DIR / f"{pdf_file.stem}.json"
-        with open(output_file, "w", encoding='utf-8') as f:
-            json.dump(result, f, indent=4, ensure_ascii=False)
-        print(f" -> Success. Outline saved to '{output_file.name}'")
+    # Each PDF is independent, so spread them across worker processes
+    max_workers = min(len(pdf_files), os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
+        for pdf_file in pdf_files:
+            print(f"\nProcessing '{pdf_file.name}'...")
+            futures[executor.submit(process_single_pdf, pdf_file)] = pdf_file
+
+        for future in as_completed(futures):
+            pdf_file = futures[future]
+            result = future.result()
+
+            output_file = OUTPUT_DIR / f"{pdf_file.stem}.json"
+            with open(output_file, "w", encoding='utf-8') as f:
+                # Serialize in one call and write once; json.dump with indent
+                # otherwise issues a separate write for every token
+                f.write(json.dumps(result, indent=4, ensure_ascii=False))
+            print(f" -> Success. Outline saved to '{output_file.name}'")
         
     print("\n--- All files processed. ---")
 